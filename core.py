@@ -167,8 +167,10 @@ def reconstruct_observation(observation_vector, eigen_vector_matrix):
         The residuals from the observation and the model
 
     """
-    eigen_by_transpose = np.matmul(eigen_vector_matrix, eigen_vector_matrix.T)
-    reconstructed_observation = np.matmul(observation_vector, eigen_by_transpose)
+    # (y.E).E^T is the same as y.(E.E^T) but never forms the
+    # [length, length] projection matrix
+    projection = np.matmul(observation_vector, eigen_vector_matrix)
+    reconstructed_observation = np.matmul(projection, eigen_vector_matrix.T)
 
     return reconstructed_observation
 
@@ -197,7 +199,7 @@ def get_residual(observation_vector, eigen_vector_matrix):
 
     return residuals
 
-def get_mag_residual_sq(residuals):
+def get_mag_residual_sq(residuals, axis=None):
     """
     This function works out the magnitude squared residual of a vector
     of residuals.
@@ -206,6 +208,9 @@ def get_mag_residual_sq(residuals):
     ----------
     residuals : array_like
         The residuals from the observation and the model
+    axis : None or int, optional
+        Axis to sum over. Use `axis=1` for a matrix of residuals, one
+        spectrum per row. The default is None.
 
     Returns
     -------
@@ -213,7 +218,7 @@ def get_mag_residual_sq(residuals):
         the squared magnitude of the given residuals
 
     """
-    mag_residuals_sq = np.nansum(residuals**2)
+    mag_residuals_sq = np.nansum(residuals**2, axis=axis)
 
     return mag_residuals_sq
 
@@ -356,7 +361,8 @@ def update_weighted_mean(mean_prev, observation_vector, gamma1):
         Vector of the new location estimate.
 
     """
-    mean_new = mean_prev + (1 - gamma1) * observation_vector
+    # As a Python float, gamma does not upcast single precision vectors
+    mean_new = mean_prev + float(1 - gamma1) * observation_vector
 
     return mean_new
 
@@ -383,7 +389,7 @@ def get_new_a(scale_sq_new, observation_vector, mag_residuals_sq, gamma2):
 
     """
     to_sqrt = (1 - gamma2) * scale_sq_new / mag_residuals_sq
-    a_next = np.sqrt(to_sqrt) * observation_vector
+    a_next = float(np.sqrt(to_sqrt)) * observation_vector
 
     return a_next
 
@@ -411,7 +417,7 @@ def get_A_current(eigen_vector_matrix, eigen_values, gamma2):
         Dimensions: (length of each spectra, number of eigen vectors)
 
     """
-    A = np.sqrt(gamma2 * eigen_values) * eigen_vector_matrix
+    A = np.sqrt(gamma2 * eigen_values).astype(eigen_vector_matrix.dtype) * eigen_vector_matrix
 
     return A
 
@@ -461,7 +467,10 @@ def do_SVD_of_AtA(A_new):
         Vector containing the singular values.
 
     """
-    B = np.matmul(A_new.T, A_new)
+    # B squares the condition number of A, which for eigen values spanning
+    # many orders of magnitude is beyond single precision. B is small, so
+    # is always formed and decomposed in double precision
+    B = np.matmul(A_new.T, A_new, dtype=np.float64)
 
     # performs SVD using LAPACK method
     #B is symmetric square matrix, therefore singular values = eigenvalues
@@ -510,7 +519,7 @@ def update_eigen_system(eigen_vectors_B, singular_values_B, A_new, No_of_vectors
         Vector containing the final singular values
 
     """
-    new_eigen_vectors = np.matmul(A_new, eigen_vectors_B)
+    new_eigen_vectors = np.matmul(A_new, eigen_vectors_B.astype(A_new.dtype))
 
     new_eigen_vectors = new_eigen_vectors[:,:No_of_vectors]
     eigen_values = singular_values_B[:No_of_vectors]
@@ -536,7 +545,7 @@ def normalise_eigen_vectors(eigen_vectors, eigen_values):
         Dimensions: (length of each spectra, number of eigen vectors)
 
     """
-    eigen_vectors_norm = eigen_vectors / np.sqrt(eigen_values)
+    eigen_vectors_norm = eigen_vectors / np.sqrt(eigen_values).astype(eigen_vectors.dtype)
 
     return eigen_vectors_norm
 
@@ -685,7 +694,7 @@ def get_filled_observation_vector(new_spectra, eigen_vectors, mean_prev, error_a
 
     return observation_vector, reconstructed_spectra
 
-def iterate_PCA_with_data_gaps(eigen_system_dict, new_spectra, alpha, error_array, delta=0.5,
+def iterate_PCA_with_data_gaps(eigen_system, new_spectra, alpha, error_array, delta=0.5,
                 robust_function=cauchy_like_function,
                 robust_derivative=derivate_of_cauchy_like_function,
                 c_sq=0.787**2):
@@ -696,8 +705,8 @@ def iterate_PCA_with_data_gaps(eigen_system_dict, new_spectra, alpha, error_arra
 
     Parameters
     ----------
-    eigen_system_dict : dictionary
-        Dictionary containing the eigenbasis, location (i.e., mean),
+    eigen_system : robustpca.EigenSystem
+        Container holding the eigenbasis, location (i.e., mean),
         scale squared (sigma squared) and robust weights (vqu).
     new_spectra : array_like
         Current spectrum to iterate the PCA with
@@ -720,26 +729,26 @@ def iterate_PCA_with_data_gaps(eigen_system_dict, new_spectra, alpha, error_arra
 
     Returns
     -------
-    eigen_system_dict : dictionary
-        Dictionary containing the updated eigenbasis, location (i.e., mean),
+    eigen_system : robustpca.EigenSystem
+        Container holding the updated eigenbasis, location (i.e., mean),
         scale squared (sigma squared) and robust weights (vqu).
 
     """
-    eigen_vectors = eigen_system_dict['U']     #eigenvectors as (nbin,nvec) array
-    mean_prev = eigen_system_dict['m']         #mean (nbin) vector
+    eigen_vectors = eigen_system.U     #eigenvectors as (nbin,nvec) array
+    mean_prev = eigen_system.m         #mean (nbin) vector
 
     observation_vector, reconstructed_spectra = get_filled_observation_vector(new_spectra, eigen_vectors, mean_prev, error_array)
     residuals = observation_vector - reconstructed_spectra
 
-    eigen_system_dict = PCA_from_residuals(eigen_system_dict, residuals, observation_vector, alpha, delta=delta,
+    eigen_system = PCA_from_residuals(eigen_system, residuals, observation_vector, alpha, delta=delta,
                 robust_function=robust_function,
                 robust_derivative=robust_derivative,
                 c_sq=c_sq)
 
-    return eigen_system_dict
+    return eigen_system
 
 
-def iterate_PCA(eigen_system_dict, new_spectra, alpha, error_array=None, delta=0.5,
+def iterate_PCA(eigen_system, new_spectra, alpha, error_array=None, delta=0.5,
                 robust_function=cauchy_like_function,
                 robust_derivative=derivate_of_cauchy_like_function,
                 c_sq=0.787**2):
@@ -749,8 +758,8 @@ def iterate_PCA(eigen_system_dict, new_spectra, alpha, error_array=None, delta=0
 
     Parameters
     ----------
-    eigen_system_dict : dictionary
-        Dictionary containing the eigenbasis, location (i.e., mean),
+    eigen_system : robustpca.EigenSystem
+        Container holding the eigenbasis, location (i.e., mean),
         scale squared (sigma squared) and robust weights (vqu).
     new_spectra : array_like
         Current spectrum to iterate the PCA with
@@ -773,13 +782,13 @@ def iterate_PCA(eigen_system_dict, new_spectra, alpha, error_array=None, delta=0
 
     Returns
     -------
-    eigen_system_dict : dictionary
-        Dictionary containing the updated eigenbasis, location (i.e., mean),
+    eigen_system : robustpca.EigenSystem
+        Container holding the updated eigenbasis, location (i.e., mean),
         scale squared (sigma squared) and robust weights (vqu).
     """
     # eigen_vectors. Columns are the eigen vectors
-    eigen_vectors = eigen_system_dict['U']
-    mean_prev = eigen_system_dict['m']
+    eigen_vectors = eigen_system.U
+    mean_prev = eigen_system.m
 
     observation_vector = get_observation_vector(new_spectra=new_spectra,
                                                 previous_mean_spectra=mean_prev)
@@ -787,14 +796,14 @@ def iterate_PCA(eigen_system_dict, new_spectra, alpha, error_array=None, delta=0
     residuals = get_residual(observation_vector=observation_vector,
                              eigen_vector_matrix=eigen_vectors)
 
-    eigen_system_dict = PCA_from_residuals(eigen_system_dict, residuals, observation_vector, alpha, delta=delta,
+    eigen_system = PCA_from_residuals(eigen_system, residuals, observation_vector, alpha, delta=delta,
                 robust_function=robust_function,
                 robust_derivative=robust_derivative,
                 c_sq=c_sq)
 
-    return eigen_system_dict
+    return eigen_system
 
-def PCA_from_residuals(eigen_system_dict, residuals, observation_vector, alpha, delta=0.5,
+def PCA_from_residuals(eigen_system, residuals, observation_vector, alpha, delta=0.5,
                 robust_function=cauchy_like_function,
                 robust_derivative=derivate_of_cauchy_like_function,
                 c_sq=0.787**2):
@@ -803,8 +812,8 @@ def PCA_from_residuals(eigen_system_dict, residuals, observation_vector, alpha,
 
     Parameters
     ----------
-    eigen_system_dict : dictionary
-        Dictionary containing the eigenbasis, location (i.e., mean),
+    eigen_system : robustpca.EigenSystem
+        Container holding the eigenbasis, location (i.e., mean),
         scale squared (sigma squared) and robust weights (vqu).
     residuals : array_like
         The residuals of the data to the pca reconstructed data
@@ -829,16 +838,16 @@ def PCA_from_residuals(eigen_system_dict, residuals, observation_vector, alpha,
 
     Returns
     -------
-    eigen_system_dict : dictionary
-        Dictionary containing the updated eigenbasis, location (i.e., mean),
+    eigen_system : robustpca.EigenSystem
+        Container holding the updated eigenbasis, location (i.e., mean),
         scale squared (sigma squared) and robust weights (vqu).
     """
-    #for now, kept the same dictionary names as VW ILD implementation
-    eigen_vectors = eigen_system_dict['U']     #eigenvectors as (nbin,nvec) array
-    eigen_values = eigen_system_dict['W']      #eigenvalues (nvec) vector
-    mean_prev = eigen_system_dict['m']         #mean (nbin) vector
-    vqu_prev = eigen_system_dict['vqu']        #running weights 1x3 array
-    sigma_sq = eigen_system_dict['sig2']       #scale float
+    #for now, kept the same attribute names as VW ILD implementation
+    eigen_vectors = eigen_system.U     #eigenvectors as (nbin,nvec) array
+    eigen_values = eigen_system.W      #eigenvalues (nvec) vector
+    mean_prev = eigen_system.m         #mean (nbin) vector
+    vqu_prev = eigen_system.vqu        #running weights 1x3 array
+    sigma_sq = eigen_system.sig2       #scale float
 
 
     mag_residual_sq = get_mag_residual_sq(residuals=residuals)
@@ -855,13 +864,13 @@ def PCA_from_residuals(eigen_system_dict, residuals, observation_vector, alpha,
                            vqu_prev=vqu_prev,
                            alpha=alpha)
 
-    eigen_system_dict['vqu'] =vqu_new
+    eigen_system.vqu = vqu_new
 
     #Must update mean and scale BEFORE updating A matrix
     new_mean = update_weighted_mean(mean_prev=mean_prev,
                                     observation_vector=observation_vector,
                                     gamma1=gammas123[0])
-    eigen_system_dict['m'] = new_mean
+    eigen_system.m = new_mean
 
     new_scale_sq = update_scale_sq(scale_sq_prev=sigma_sq,
                                    mag_residuals_sq=mag_residual_sq,
@@ -870,7 +879,7 @@ def PCA_from_residuals(eigen_system_dict, residuals, observation_vector, alpha,
                                    c_sq=c_sq,
                                    robust_function=robust_function)
 
-    eigen_system_dict['sig2'] = new_scale_sq
+    eigen_system.sig2 = new_scale_sq
 
     new_a = get_new_a(scale_sq_new=new_scale_sq,
                       observation_vector=observation_vector,
@@ -894,10 +903,152 @@ def PCA_from_residuals(eigen_system_dict, residuals, observation_vector, alpha,
     eigen_vectors_new_normed = normalise_eigen_vectors(eigen_vectors=eigen_vectors_new,
                                                        eigen_values=eigen_values_new)
 
-    eigen_system_dict['U'] = eigen_vectors_new_normed
-    eigen_system_dict['W'] = eigen_values_new
+    eigen_system.U = eigen_vectors_new_normed
+    eigen_system.W = eigen_values_new
 
-    return eigen_system_dict
+    return eigen_system
+
+def iterate_PCA_batch(eigen_system, new_spectra, alpha, error_array=None, delta=0.5,
+                      robust_function=cauchy_like_function,
+                      robust_derivative=derivate_of_cauchy_like_function,
+                      c_sq=0.787**2):
+    """
+    Mini-batch version of `iterate_PCA` and `iterate_PCA_with_data_gaps`
+    that updates the eigen system with several spectra at once.
+    All the spectra in the batch are centred and reconstructed using the
+    eigen system and mean from the start of the batch, so their residuals
+    and the a_i below use that mean. The running weights, mean and scale
+    are then updated spectrum by spectrum as in eq. (17)-(22) of Budavari
+    et al 2009, with the mean using each spectrum minus the mean updated
+    by the previous spectra in the batch. This is only scalar and vector
+    work. Since each update
+    of the covariance down-weights all previous ones by gamma2, the
+    sequence of rank 1 updates in the batch can be written as one matrix
+    A = [sqrt(prod(gamma2) W) U, a_1 ... a_B], with each a_i (eq. (9))
+    scaled by the gamma2 terms of the spectra that come after it. Only a
+    single SVD of A^T.A is then needed for the whole batch, which is formed
+    with one matrix-matrix multiplication.
+    For a batch containing one spectrum this is identical to `iterate_PCA`.
+
+    Parameters
+    ----------
+    eigen_system : robustpca.EigenSystem
+        Container holding the eigenbasis, location (i.e., mean),
+        scale squared (sigma squared) and robust weights (vqu).
+    new_spectra : array_like
+        Spectra to iterate the PCA with
+        Dimensions: (number of spectra in batch, length of each spectra)
+    alpha : float
+        'The forget' parameter. Value between 0 to 1. Controls how long
+        previous solutions influence the current solution
+    error_array : None or array_like, optional
+        Error estimates of the data, where zeros represent bad pixels in the
+        spectra. If None, all the data is assumed to be good.
+        Dimensions: (number of spectra in batch, length of each spectra)
+        The default is None.
+    delta : float, optional
+        Delta is the breakdown point (between 0 to 0.5). The default is 0.5.
+    robust_function : function, optional
+        Function used to down-weight outliers. The default is cauchy_like_function.
+    robust_derivative : function, optional
+        Derivative of the function used to down-weight outliers.
+        The default is derivate_of_cauchy_like_function.
+    c_sq : float, optional
+        Parameter for setting when the robust function down-weights
+        outliers. The default is 0.787**2.
+
+    Returns
+    -------
+    eigen_system : robustpca.EigenSystem
+        Container holding the updated eigenbasis, location (i.e., mean),
+        scale squared (sigma squared) and robust weights (vqu).
+    """
+    eigen_vectors = eigen_system.U
+    eigen_values = eigen_system.W
+    mean_start = eigen_system.m
+    mean_new = mean_start
+    vqu_new = eigen_system.vqu
+    scale_sq_new = eigen_system.sig2
+
+    if error_array is None:
+        observation_vectors = get_observation_vector(new_spectra=new_spectra,
+                                                     previous_mean_spectra=mean_start)
+        residuals = get_residual(observation_vector=observation_vectors,
+                                 eigen_vector_matrix=eigen_vectors)
+    else:
+        filled = [get_filled_observation_vector(spectra, eigen_vectors, mean_start, errors)
+                  for spectra, errors in zip(new_spectra, error_array)]
+        observation_vectors = np.array([observation_vector for observation_vector, _ in filled])
+        residuals = observation_vectors - np.array([reconstructed for _, reconstructed in filled])
+
+    mag_residuals_sq = get_mag_residual_sq(residuals=residuals, axis=1)
+
+    batch_size = len(mag_residuals_sq)
+    gamma2s = np.empty(batch_size)
+    a_scales = np.empty(batch_size)
+    for i in range(batch_size):
+        weight1 = robust_derivative(t=mag_residuals_sq[i] / scale_sq_new, c_sq=c_sq)
+
+        weight_coefficants = get_vqu_coeficents(robust_derivative=weight1,
+                                                mag_residuals_sq=mag_residuals_sq[i])
+        vqu_prev = vqu_new
+        vqu_new = update_vqu(vqu_prev=vqu_prev,
+                             weights=weight_coefficants,
+                             alpha=alpha)
+        gammas123 = get_gammas(vqu=vqu_new,
+                               vqu_prev=vqu_prev,
+                               alpha=alpha)
+
+        # The observation vectors are centred on the mean at the start of
+        # the batch, eq. (17) needs the spectrum minus the latest mean
+        mean_new = update_weighted_mean(mean_prev=mean_new,
+                                        observation_vector=observation_vectors[i] + (mean_start - mean_new),
+                                        gamma1=gammas123[0])
+
+        scale_sq_new = update_scale_sq(scale_sq_prev=scale_sq_new,
+                                       mag_residuals_sq=mag_residuals_sq[i],
+                                       gamma3=gammas123[2],
+                                       delta=delta,
+                                       c_sq=c_sq,
+                                       robust_function=robust_function)
+
+        # a_i squared is (1 - gamma2) * sigma^2 / r^2 * y^2 (eq. (9))
+        gamma2s[i] = gammas123[1]
+        a_scales[i] = (1 - gamma2s[i]) * scale_sq_new / mag_residuals_sq[i]
+
+    eigen_system.vqu = vqu_new
+    eigen_system.m = mean_new
+    eigen_system.sig2 = scale_sq_new
+
+    # Product of the gamma2 of all the later spectra in the batch
+    later_gamma2s = np.ones_like(gamma2s)
+    later_gamma2s[:-1] = np.cumprod(gamma2s[::-1])[::-1][1:]
+    # The gammas are kept in double precision, only the scaling of the
+    # vectors is done in the precision of the data
+    a_norms = np.sqrt(a_scales * later_gamma2s).astype(observation_vectors.dtype)
+    new_a = a_norms[:,None] * observation_vectors
+
+    A = get_A_current(eigen_vector_matrix=eigen_vectors,
+                      eigen_values=eigen_values,
+                      gamma2=np.prod(gamma2s))
+
+    A_new = np.concatenate([A, new_a.T], axis=1)
+
+    #singular_values_B are the eigenvalues since B is a square array
+    eigen_vectors_B, singular_values_B = do_SVD_of_AtA(A_new=A_new)
+
+    eigen_vectors_new, eigen_values_new = update_eigen_system(eigen_vectors_B=eigen_vectors_B,
+                                                                 singular_values_B=singular_values_B,
+                                                                 A_new=A_new,
+                                                                 No_of_vectors=len(eigen_values))
+
+    eigen_vectors_new_normed = normalise_eigen_vectors(eigen_vectors=eigen_vectors_new,
+                                                       eigen_values=eigen_values_new)
+
+    eigen_system.U = eigen_vectors_new_normed
+    eigen_system.W = eigen_values_new
+
+    return eigen_system
 
 def main():
     pass
@@ -219,7 +219,7 @@ def get_dchi_sq_dnorm(weights, data, mean_array, eigen_vectors):
     mean_dot_data = dot_product_vectorised(weighted_mean, data)
     mean_dot_mean = dot_product_vectorised(weighted_mean, mean_array)
 
-    eigen_vectors_3d = np.ones([data.shape[0], *eigen_vectors.shape]) * eigen_vectors
+    eigen_vectors_3d = np.ones([data.shape[0], *eigen_vectors.shape], dtype=eigen_vectors.dtype) * eigen_vectors
     ###
     # Each weight*mean spectrum is multiplied with the eigen vectors.
     # we then sum along the length of the data, so we end up with a matrix
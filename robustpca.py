@@ -15,27 +15,117 @@ random oder of spectra)
 NOTES:
     The initial mean is based of the entire dataset, rather than the 
     initialised amount
-    The initial eigen vectors and values are calculated using the entire 
-    dataset rather than the initialise amount
+    The initial eigen vectors and values are calculated using only the
+    initialise amount. The initial scale is found from the residuals of
+    the spectra that follow these, since the residuals of spectra used to
+    make the eigen vectors are too small
+    The initialisation is a few large matrix multiplications that are
+    already multi-threaded by the BLAS library numpy is built against
+    (check with `np.show_config()`), so they should not be wrapped in a
+    thread pool. The per spectrum updates only use small matrices, where
+    BLAS threading can cost more than it saves. If so, limit the threads
+    for the call (e.g., `OMP_NUM_THREADS`/`MKL_NUM_THREADS` set before numpy
+    is imported, or `threadpoolctl.threadpool_limits`).
 Based of: Copyright (C) 2007 Tamas Budavari and Vivienne Wild (MAGPop)
 """
 
+import warnings
+from dataclasses import dataclass
 import numpy as np
 import core
 import utilitymasking as util
 
+@dataclass(slots=True)
+class EigenSystem:
+    """
+    The eigen system updated by the robust PCA. Attributes are used
+    rather than dictionary keys since they are looked up for every
+    spectrum. Names match the VW IDL implementation.
+
+    Attributes
+    ----------
+    U : array_like
+        The eigen vectors
+        Dimensions: [length of spectra, number of eigen vectors]
+    m : array_like
+        The location (i.e., mean) vector
+        Dimensions: [length of spectra]
+    W : array_like
+        The eigen values
+    vqu : array_like
+        1D array containing the three running totals used to update the
+        iterative statistics
+    sig2 : float
+        The scale squared (sigma squared)
+
+    """
+    U: np.ndarray
+    m: np.ndarray
+    W: np.ndarray
+    vqu: np.ndarray
+    sig2: float
+
+    def to_dict(self):
+        """
+        Returns the eigen system as a dictionary with the keys 'U', 'm',
+        'W', 'vqu' and 'sig2', matching previous SDSS versions of the
+        PCA library.
+        """
+        return {'U':self.U, 'm':self.m, 'W':self.W, 'vqu':self.vqu, 'sig2':self.sig2}
+
+def get_data_mean(data, errors=None):
+    """
+    Calculates the mean of the spectra. If an error array is given, bad
+    values (set to zero in `errors`) are ignored when calculating the mean.
+    Pixels where every spectrum is bad fall back to the mean of all the
+    data at that pixel.
+
+    Parameters
+    ----------
+    data : array_like
+        The data
+        Dimensions: [number of spectra, length of spectra]
+    errors : None type or array_like, optional
+        Array containing the data errors, where zero indicates where the
+        data is bad. If None, assumes all the data is valid.
+        The default is None.
+
+    Returns
+    -------
+    vector_mean : array like
+        The mean data vector
+        Dimensions: [length of spectra]
+
+    """
+    if errors is None:
+        return np.nanmean(data, axis=0)
+
+    good_data = ~np.isnan(data)
+    good_data &= errors != 0
+    amount_good = np.count_nonzero(good_data, axis=0)
+    sum_good = np.sum(data, axis=0, where=good_data)
+
+    all_bad = amount_good == 0
+    vector_mean = sum_good / np.where(all_bad, 1, amount_good).astype(data.dtype)
+    if np.any(all_bad):
+        vector_mean[all_bad] = np.nanmean(data[:, all_bad], axis=0)
+
+    return vector_mean
+
 def mean_subtracted_data(data, errors=None):
     """
-    Calculates the mean and subtracts it from each spectra.
-    
-    TODO: Might help if bad values are ignored in this calculation using
-    the error array.    
+    Calculates the mean (see `get_data_mean`) and subtracts it from each
+    spectra.
 
     Parameters
     ----------
     data : array_like
         The data to centre
         Dimensions: [number of spectra, length of spectra]
+    errors : None type or array_like, optional
+        Array containing the data errors, where zero indicates where the
+        data is bad. If None, assumes all the data is valid.
+        The default is None.
 
     Returns
     -------
@@ -47,16 +137,18 @@ def mean_subtracted_data(data, errors=None):
         Dimensions: [length of spectra]
 
     """
-    vector_mean = np.nanmean(data, axis=0)
+    vector_mean = get_data_mean(data=data, errors=errors)
     centred_data = data - vector_mean
 
     return centred_data, vector_mean
 
-def do_initial_SVD(data):
+def do_initial_SVD(data, amount_of_eigen=None):
     """
     Runs SVD on a data array to calculate the eigen vectors transpose
     and singular values. (singular values are the positive root of the
-    eigen values).
+    eigen values). Only the reduced (thin) SVD is calculated, so the
+    [number of spectra, number of spectra] left singular vectors are
+    never formed.
     WARNING: The eigen vectors returned are transposed.
 
     Parameters
@@ -64,18 +156,21 @@ def do_initial_SVD(data):
     data : array_like
         Centered normalised data
         Dimensions: [number of spectra, length of spectra]
+    amount_of_eigen : None type or int, optional
+        Number of eigen vectors to keep. If None, all of the eigen vectors
+        from the reduced SVD are returned. The default is None.
 
     Returns
     -------
     eigen_vectors_T : array_like
         Eigen vectors transposed representing the data
-        Dimensions: [length of spectra, length of spectra]
+        Dimensions: [number of eigen vectors, length of spectra]
     singular_values : 1d array
         Singular values of the SVD decomposition
 
     """
     try:
-        singular_values, eigen_vectors_T =  np.linalg.svd(data)[1:]
+        singular_values, eigen_vectors_T =  np.linalg.svd(data, full_matrices=False)[1:]
     except np.linalg.LinAlgError:
         raise TypeError('Cannot have nans present in the data. Please '\
                         'set NaNs and infs to a reasonable finite number '\
@@ -86,9 +181,12 @@ def do_initial_SVD(data):
                         'To do this, you can use the convenience function '\
                         '`replace_nonfinite_with_median`')
 
+    eigen_vectors_T = eigen_vectors_T[:amount_of_eigen]
+    singular_values = singular_values[:amount_of_eigen]
+
     return eigen_vectors_T, singular_values
 
-def get_eigen_system(data):
+def get_eigen_system(data, amount_of_eigen=None):
     """
     Method for calculating the eigen vectors and values of the data using
     SVD.
@@ -98,22 +196,26 @@ def get_eigen_system(data):
     data : array_like
         Cantered normalised data
         Dimensions: [number of spectra, length of spectra]
+    amount_of_eigen : None type or int, optional
+        Number of eigen vectors to keep. If None, all are kept.
+        The default is None.
 
     Returns
     -------
     eigen_vectors_T.T: array_like
         Eigen vectors representing the data
-        Dimensions: [length of spectra, length of spectra]
+        Dimensions: [length of spectra, number of eigen vectors]
     eigen_values : 1d array
         Eigen values of data
     """
-    eigen_vectors_T, singular_values = do_initial_SVD(data=data)
-    eigen_values = singular_values**2
+    eigen_vectors_T, singular_values = do_initial_SVD(data=data, amount_of_eigen=amount_of_eigen)
+    # singular_values is a fresh LAPACK output, so it can be squared in place
+    eigen_values = np.square(singular_values, out=singular_values)
 
     # array.T performs a matrix transpose
     return eigen_vectors_T.T, eigen_values
 
-def initalise_eigensystem(data_centred):
+def initalise_eigensystem(data_centred, amount_of_eigen=None):
     """
     Method wrapping around the data to calculate the eigen vectors and values
     Data needs to be normalise, which is done here.
@@ -122,37 +224,42 @@ def initalise_eigensystem(data_centred):
     ----------
     data_centred : array_like
         Data that has been centred
+    amount_of_eigen : None type or int, optional
+        Number of eigen vectors to keep. If None, all are kept.
+        The default is None.
 
     Returns
     -------
     eigen_vectors: array_like
         Eigen vectors representing the data
-        Dimensions: [length of spectra, length of spectra]
+        Dimensions: [length of spectra, number of eigen vectors]
     eigen_values : 1d array
         Eigen values of data
 
     """
     amount_of_data_vectors = data_centred.shape[0]
-    data_normed = data_centred /  np.sqrt(amount_of_data_vectors)
+    # Python float keeps the precision of the data (np.sqrt would upcast)
+    data_normed = data_centred / amount_of_data_vectors**0.5
 
-    eigen_vectors, eigen_values = get_eigen_system(data=data_normed)
+    eigen_vectors, eigen_values = get_eigen_system(data=data_normed, amount_of_eigen=amount_of_eigen)
 
     return eigen_vectors, eigen_values
 
 def reconstruct_observation(eigen_by_transpose, observation_vector):
     """
     Reconstructs observation vectors using the given eigen
-    vectors and the data.
+    vectors multiplied by their transpose and the data.
+    DEPRECATED: Forming E.E^T is far more expensive than projecting onto
+    the eigenvectors. Use `get_residual_lowrank` instead.
 
     Parameters
     ----------
+    eigen_by_transpose : 2d array_like matrix
+        The eigenvector matrix multiplied by its transpose, E.E^T
+        Dimensions: [length of spectra, length of spectra]
     observation_vector : array_like
         A vector or matrix transpose containing the current
         mean subtracted spectra
-    eigen_vector_matrix : 2d array_like matrix
-        A 2d array containing eigenvectors. Each column
-        (eigen_vector_matrix[:,i]) is an eigenvector
-        Dimensions: [length of spectra, number of eigen vectors]
 
     Returns
     -------
@@ -160,6 +267,10 @@ def reconstruct_observation(eigen_by_transpose, observation_vector):
         The residuals from the observation and the model
 
     """
+    warnings.warn('`reconstruct_observation` is deprecated and will be '\
+                  'removed. Use `get_residual_lowrank`, which never forms '\
+                  'the [length, length] matrix E.E^T.', DeprecationWarning)
+
     reconstructed_observation = np.matmul(observation_vector, eigen_by_transpose)
 
     return reconstructed_observation
@@ -168,7 +279,8 @@ def get_residual(observation_vector, eigen_vector_matrix):
     """
     This function works out the residual between the observation
     vector and its reconstruction (see eq. 10 in Budavari et al 2009).
-    Here is is the matrix version of the calculation.
+    Here is is the matrix version of the calculation. Kept for existing
+    callers; see `get_residual_lowrank`.
 
     Parameters
     ----------
@@ -186,11 +298,36 @@ def get_residual(observation_vector, eigen_vector_matrix):
         The residuals from the observation and the model
 
     """
-    #multiplying the eigenvectors by its transpositions: E.E^T
-    eigen_by_transpose = np.matmul(eigen_vector_matrix, eigen_vector_matrix.T)
+    residuals = get_residual_lowrank(observation_vector, eigen_vector_matrix)
+
+    return residuals
+
+def get_residual_lowrank(observation_vector, eigen_vector_matrix):
+    """
+    Works out the residual between the observation vector and its
+    reconstruction using the low rank form y - (y.E).E^T, so the
+    [length of spectra, length of spectra] matrix E.E^T is never formed.
+
+    Parameters
+    ----------
+    observation_vector : array_like
+        A vector or matrix containing the current
+        mean subtracted data
+    eigen_vector_matrix : 2d array_like matrix
+        A 2d array containing eigenvectors. Each column
+        (eigen_vector_matrix[:,i]) is an eigenvector
+        Dimensions: [length of spectra, number of eigen vectors]
 
-    #reconstructing data using eigen-system: y(E.E^T),
-    reconstruct_observation_vector = reconstruct_observation(eigen_by_transpose, observation_vector)
+    Returns
+    -------
+    residuals : array_like
+        The residuals from the observation and the model
+
+    """
+    #reconstructing data using eigen-system: (y.E).E^T. Projecting onto the
+    #eigenvectors first avoids forming the [length, length] matrix E.E^T
+    projection = np.matmul(observation_vector, eigen_vector_matrix)
+    reconstruct_observation_vector = np.matmul(projection, eigen_vector_matrix.T)
 
     residuals = observation_vector - reconstruct_observation_vector
 
@@ -207,6 +344,8 @@ def mag_residual_sq(residuals, error_map=None):
     residuals : array_like
         The residuals from the observation and the model
     error_map: None type or array_like, optional
+        Array where zeros represent bad data points to exclude from the
+        sum. The default is None.
 
     Returns
     -------
@@ -214,18 +353,24 @@ def mag_residual_sq(residuals, error_map=None):
         the squared magnitude of the given residuals
 
     """
-    if error_map is not None:
-        error_map = error_map[:residuals.shape[0]]
-        residuals[error_map==0] = np.nan
+    if error_map is None:
+        return np.einsum('ij,ij->i', residuals, residuals)
+
+    error_map = error_map[:residuals.shape[0]]
+    good_data = (error_map != 0).astype(residuals.dtype)
 
-    mag_residuals_sq = np.nansum(residuals**2, axis=1)
+    mag_residuals_sq = np.einsum('ij,ij,ij->i', residuals, residuals, good_data)
 
     return mag_residuals_sq
 
 def get_mag_residuals_sq(data, eigen_vectors, error_map=None):
     """
     This function works out the magnitude squared residuals of a vector, or
-    matrix of residuals.
+    matrix of residuals. If no error map is given and the data is double
+    precision, the eigenvectors are orthonormal so
+    |y - y.E.E^T|^2 = |y|^2 - |y.E|^2, meaning the residuals never need to
+    be formed. In single precision the two terms cancel for well
+    reconstructed spectra, so the residuals are formed instead.
 
     Parameters
     ----------
@@ -236,7 +381,9 @@ def get_mag_residuals_sq(data, eigen_vectors, error_map=None):
         A 2d array containing eigenvectors. Each column
         (eigen_vector_matrix[:,i]) is an eigenvector
         Dimensions: [length of spectra, number of eigen vectors]
-
+    error_map: None type or array_like, optional
+        Array where zeros represent bad data points to exclude from the
+        sum. The default is None.
 
     Returns
     -------
@@ -244,7 +391,18 @@ def get_mag_residuals_sq(data, eigen_vectors, error_map=None):
         The squared magnitude of the given residuals
 
     """
-    residuals_transpose = get_residual(data, eigen_vectors)
+    if error_map is None and np.result_type(data, eigen_vectors) == np.float64:
+        projection = np.matmul(data, eigen_vectors)
+        data_mag_sq = np.einsum('ij,ij->i', data, data)
+        projection_mag_sq = np.einsum('ij,ij->i', projection, projection)
+
+        # Only a guard against rounding, which can make near perfect
+        # reconstructions slightly negative. In double precision the
+        # rounding is ~1e-16 |y|^2, so clipping cannot hide a residual
+        # large enough to matter (single precision never reaches here)
+        return np.maximum(data_mag_sq - projection_mag_sq, 0)
+
+    residuals_transpose = get_residual_lowrank(data, eigen_vectors)
     mag_residuals_squared = mag_residual_sq(residuals_transpose, error_map=error_map)
 
     return mag_residuals_squared
@@ -278,13 +436,18 @@ def initalise_scale_using_residuals_sq(residuals_sq, breakdown_point=0.5, amount
         Scale squared estimator
 
     """
-    scale_sq = np.nanmean(residuals_sq)
+    # Bad values are dropped once here so that each iteration can use the
+    # much cheaper `np.mean` rather than `np.nanmean`
+    residuals_sq = residuals_sq[~np.isnan(residuals_sq)]
+    # The scale is a single number, so is kept in double precision
+    scale_sq = np.mean(residuals_sq, dtype=np.float64)
 
+    t = np.empty_like(residuals_sq)
     for i in range(amount_of_eigen):
 
-        t = residuals_sq/scale_sq
+        np.divide(residuals_sq, scale_sq, out=t)
         robust_weighting = robust_function(t=t, c_sq=c_sq)
-        scale_sq *= np.nanmean(robust_weighting) / breakdown_point
+        scale_sq *= np.mean(robust_weighting) / breakdown_point
 
     return scale_sq
 
@@ -316,13 +479,13 @@ def initalise_vqu(residuals_sq, scale_sq, robust_derivative=core.derivate_of_cau
     t = residuals_sq/scale_sq
     weight1 = robust_derivative(t=t, c_sq=c_sq)
 
-    weight_coefficants_3 = np.ones_like(weight1)
-
-    vqu_vectors = np.column_stack([weight1,
-                                   weight1*residuals_sq,
-                                   weight_coefficants_3])
-
-    inital_quv = np.nanmean(vqu_vectors, axis=0)
+    # The weight for the mean is 1 for every spectrum (see
+    # `core.get_vqu_coeficents`), so its average is always 1. The running
+    # totals are always double precision, since in single precision their
+    # rounding biases the gammas for large datasets
+    inital_quv = np.array([np.nanmean(weight1),
+                           np.nanmean(weight1*residuals_sq),
+                           1], dtype=np.float64)
 
     return inital_quv
 
@@ -347,16 +510,16 @@ def input_for_pca(mean_array, eigen_values, eigen_vectors, scale_sq, vqu):
 
     Returns
     -------
-    eigen_system_dict : dictionary
-        Dictionary containing the initial eigenbasis, location (i.e., mean),
+    eigen_system : EigenSystem
+        Container holding the initial eigenbasis, location (i.e., mean),
         scale squared (sigma squared) and robust weights (vqu).
 
     """
-    eigen_system_dict = {'U':eigen_vectors, 'm':mean_array,
-                         'W':eigen_values,  'vqu':vqu,
-                         'sig2':scale_sq}
+    eigen_system = EigenSystem(U=eigen_vectors, m=mean_array,
+                               W=eigen_values, vqu=vqu,
+                               sig2=scale_sq)
 
-    return eigen_system_dict
+    return eigen_system
 
 def forget_parameter(amount_of_spectra, memory=1):
     """
@@ -403,7 +566,9 @@ def initalise_robust_pca_param(data, errors=None, amount_of_eigen=100, amount_to
         Number of eigen vectors to keep. The default is 10.
     amount_to_initalise : in, optional
         amount of data vectors to be used when initialising the eigen system
-        for the robust PCA. The default is 200.
+        for the robust PCA. The same amount of the following data vectors
+        are used to initialise the scale. Must be larger than
+        `amount_of_eigen`. The default is 200.
     breakdown point : Between 0 to 0.5. Sets the robustness of the statistics
         The lower the number, the faster, but less robust the result will be.
         The default is 0.5.
@@ -419,21 +584,36 @@ def initalise_robust_pca_param(data, errors=None, amount_of_eigen=100, amount_to
 
     Returns
     -------
-    eigen_system_dict : dict
-        Dictionary containing the inital eigenbasis, location (i.e., mean),
+    eigen_system : EigenSystem
+        Container holding the inital eigenbasis, location (i.e., mean),
         scale squared (sigma squared) and robust weights (vqu) needed to
         start the robust PCA method
 
     """
-    data_centred, mean_initial = mean_subtracted_data(data=data, errors=errors)
+    if amount_of_eigen >= amount_to_initalise:
+        raise ValueError('`amount_to_initalise` (%d) must be larger than '\
+                         '`amount_of_eigen` (%d)' % (amount_to_initalise, amount_of_eigen))
+    if len(data) <= amount_to_initalise:
+        raise ValueError('More than `amount_to_initalise` (%d) spectra are '\
+                         'needed to initialise the scale' % amount_to_initalise)
 
-    eigen_vectors_initial, eigen_values_inital = initalise_eigensystem(data_centred=data_centred)
+    mean_initial = get_data_mean(data=data, errors=errors)
+    # Only the spectra used for the eigen system and scale are centred,
+    # rather than making a centred copy of the whole dataset
+    data_centred = data[:2*amount_to_initalise] - mean_initial
 
-    eigen_vectors_initial = eigen_vectors_initial[:,:amount_of_eigen]
-    eigen_values_initial = eigen_values_inital[:amount_of_eigen]
+    # Only the spectra used to initialise are needed for the initial eigen
+    # system
+    eigen_vectors_initial, eigen_values_initial = initalise_eigensystem(data_centred=data_centred[:amount_to_initalise],
+                                                                        amount_of_eigen=amount_of_eigen)
 
-    residuals_sq = get_mag_residuals_sq(data=data_centred[:amount_to_initalise],
-                                    eigen_vectors=eigen_vectors_initial, error_map=errors)
+    # The eigen vectors are fit to the spectra they were made from, so
+    # their residuals underestimate the scale. The next spectra are used
+    # instead
+    scale_spectra = slice(amount_to_initalise, 2*amount_to_initalise)
+    error_map = None if errors is None else errors[scale_spectra]
+    residuals_sq = get_mag_residuals_sq(data=data_centred[scale_spectra],
+                                    eigen_vectors=eigen_vectors_initial, error_map=error_map)
 
     scale_sq_initial = initalise_scale_using_residuals_sq(residuals_sq=residuals_sq,
                                                        breakdown_point=breakdown_point,
@@ -447,16 +627,16 @@ def initalise_robust_pca_param(data, errors=None, amount_of_eigen=100, amount_to
                                 c_sq=c_sq)
 
 
-    eigen_system_dict = input_for_pca(mean_array=mean_initial,
-                                      eigen_values=eigen_values_initial,
-                                      eigen_vectors=eigen_vectors_initial,
-                                      scale_sq=scale_sq_initial, vqu=vqu_initial)
-    return eigen_system_dict
+    eigen_system = input_for_pca(mean_array=mean_initial,
+                                 eigen_values=eigen_values_initial,
+                                 eigen_vectors=eigen_vectors_initial,
+                                 scale_sq=scale_sq_initial, vqu=vqu_initial)
+    return eigen_system
 
 def run_robust_pca(data, errors=None, amount_of_eigen=100, amount_to_initalise=200,
                number_of_iterations=5, forget_param=None,
                breakdown_point=0.5, memory=1, save_extra_param=False, c_sq=0.787**2,
-               random_seed=1):
+               random_seed=1, batch_size=1, dtype=np.float32):
     """
     Main wrapper to perform the robust pca method on an entire dataset.
 
@@ -494,8 +674,29 @@ def run_robust_pca(data, errors=None, amount_of_eigen=100, amount_to_initalise=2
     c_sq : float, optional
         Parameter for setting when the robust function down-weights
         outliers. The default is 0.787**2.
-    random_seed : int
-        Seed number for the randomisation of the spectra ordering.
+    random_seed : None type or int, optional
+        Seed number for the randomisation of the spectra ordering. If None,
+        the ordering is not reproducible. The default is 1.
+    batch_size : int, optional
+        Number of spectra used to update the eigen system at once (see
+        `core.iterate_PCA_batch`). A batch size of 1 performs the original
+        spectrum by spectrum update. Larger batches (e.g., 32-128) are much
+        faster since each update is done with matrix-matrix products, but
+        the spectra in a batch are all reconstructed using the eigen system
+        from the start of the batch. When tracking the eigen system using
+        `save_extra_param`, one increment is one batch. Must be at least 1.
+        The default is 1.
+    dtype : data-type, optional
+        Floating point type the data and errors are converted to. Single
+        precision halves the memory moved by every matrix multiplication
+        and is sufficient for typical spectra. The eigen vectors and mean
+        are returned in this precision, while the eigen values, scale and
+        running weights are always double precision. Single precision keeps
+        only ~7 significant digits, so for spectra with very little noise,
+        or many eigen vectors whose eigen values span many orders of
+        magnitude, the eigen system can differ from double precision by
+        ~0.1-1%. Use `np.float64` for full precision. The default is
+        np.float32.
 
     Returns
     -------
@@ -508,6 +709,15 @@ def run_robust_pca(data, errors=None, amount_of_eigen=100, amount_to_initalise=2
         values, the v weights and scale squared
 
     """
+    if batch_size < 1:
+        raise ValueError('`batch_size` must be at least 1, not %d' % batch_size)
+
+    #Rows of the data are used one by one and in matrix multiplications, so
+    #the layout and precision are fixed once here
+    data = np.ascontiguousarray(data, dtype=dtype)
+    if errors is not None:
+        errors = np.ascontiguousarray(errors, dtype=dtype)
+
     #nans and infs cannot have linear operations performed on them
     #nans and infs have been replaced with median value which might impact
     #the initial PCA. Recommended that the original data values are used
@@ -520,53 +730,215 @@ def run_robust_pca(data, errors=None, amount_of_eigen=100, amount_to_initalise=2
     if forget_param is None:
         forget_param = forget_parameter(amount_of_spectra=amount_of_spectra,
                                         memory=memory)
-    np.random.seed = 1
-    data, errors = randomise_data_order(data, errors)
+    rng = np.random.default_rng(random_seed)
+    data, errors = randomise_data_order(data, errors, rng=rng)
 
 
 
 
-    eigen_system_dict = initalise_robust_pca_param(data=data,
-                                                   errors=errors,
-                                                   amount_of_eigen=amount_of_eigen,
-                                                   amount_to_initalise=amount_to_initalise,
-                                                   breakdown_point=breakdown_point)
+    eigen_system = initalise_robust_pca_param(data=data,
+                                              errors=errors,
+                                              amount_of_eigen=amount_of_eigen,
+                                              amount_to_initalise=amount_to_initalise,
+                                              breakdown_point=breakdown_point)
 
+    # Only used spectrum by spectrum, batches always use
+    # `core.iterate_PCA_batch`
     if errors is not None:
         pca_function = core.iterate_PCA_with_data_gaps
     else:
         pca_function = core.iterate_PCA
-        # Makes a None list of length `amount_of_spectra`
-        errors = [None] * amount_of_spectra
 
     counter = 0
-    save_amount = amount_of_spectra * number_of_iterations - amount_to_initalise + 1
-    tracked_eigen_system_dict = {}
+    if save_extra_param:
+        #Number of batches in the first, then the remaining iterations
+        save_amount = -(-(amount_of_spectra - amount_to_initalise) // batch_size) \
+                      + (number_of_iterations - 1) * -(-amount_of_spectra // batch_size) + 1
+        tracked_eigen_system_dict = initialise_tracked_eigen_updates(save_amount=save_amount,
+                                                                     amount_of_eigen=len(eigen_system.W))
+    else:
+        tracked_eigen_system_dict = None
 
     #Need to skip the data we used to initialise the eigenbasis
-    start = amount_to_initalise
-    ids = None
+    spectra_order = np.arange(amount_to_initalise, amount_of_spectra)
     for k in range(number_of_iterations):
-        for sp in range(start, amount_of_spectra):
-            tracked_eigen_system_dict, counter = track_eigensystem_updates(counter, eigen_system_dict,
-                                                                           tracked_eigen_system_dict,
-                                                                           save_amount)
-
-            eigen_system_dict = pca_function(eigen_system_dict=eigen_system_dict, new_spectra=data[sp],
-                                                  alpha=forget_param, error_array=errors[sp], delta=breakdown_point, c_sq=c_sq)
-        start = 0
+        eigen_system, counter = sweep_robust_pca(eigen_system=eigen_system,
+                                                 data=data,
+                                                 errors=errors,
+                                                 pca_function=pca_function,
+                                                 forget_param=forget_param,
+                                                 spectra_order=spectra_order,
+                                                 breakdown_point=breakdown_point,
+                                                 c_sq=c_sq,
+                                                 counter=counter,
+                                                 tracked_eigen_system_dict=tracked_eigen_system_dict,
+                                                 batch_size=batch_size)
         # after one iteration of the entire dataset, the past is forgotten
         # so we can now include the data we used to initialise the initial
         # eigen basis
-        #We also need to re-randomise the data order for the next iteration
-        data, errors = randomise_data_order(data, errors)
+        #We also need to re-randomise the data order for the next iteration.
+        #Only the indices are shuffled to avoid copying the entire dataset
+        spectra_order = rng.permutation(amount_of_spectra)
+
+    eigen_system_dict = eigen_system.to_dict()
 
     if save_extra_param:
         return eigen_system_dict, tracked_eigen_system_dict
     else:
         return eigen_system_dict
 
-def randomise_data_order(data, errors=None):
+def sweep_robust_pca(eigen_system, data, errors, pca_function, forget_param, spectra_order,
+                     breakdown_point=0.5, c_sq=0.787**2, counter=0,
+                     tracked_eigen_system_dict=None, batch_size=1):
+    """
+    Performs one pass of the robust PCA over the data, updating the eigen
+    system with each spectrum in turn. The update is sequential, so this
+    loop is the hot path of `run_robust_pca`; everything that does not
+    change between spectra is looked up once here rather than per spectrum.
+
+    Parameters
+    ----------
+    eigen_system : EigenSystem
+        Container holding the current eigenbasis, location (i.e., mean),
+        scale squared (sigma squared) and robust weights (vqu).
+    data : array_like
+        Data matrix
+        Dimensions:  [Number of spectra, length of spectra]
+    errors : None type or array_like
+        Array containing the data errors, where zero indicates bad data.
+        If None, assumes all the data is valid.
+    pca_function : function
+        The function performing a single robust PCA update, i.e.,
+        `core.iterate_PCA` or `core.iterate_PCA_with_data_gaps`
+    forget_param : float
+        Parameter which set when previous solutions are down-weighted.
+    spectra_order : array_like
+        Indices of the spectra in `data`, in the order they are to be used
+        to update the eigen system.
+    breakdown point : Float, optional
+        Between 0 to 0.5. Sets the robustness of the statistics.
+        The default is 0.5.
+    c_sq : float, optional
+        Parameter for setting when the robust function down-weights
+        outliers. The default is 0.787**2.
+    counter : int, optional
+        Current count of the increment. The default is 0.
+    tracked_eigen_system_dict : None type or dict, optional
+        Preallocated dictionary (see `initialise_tracked_eigen_updates`)
+        tracking how the robust PCA changes for each increment. Updated in
+        place. If None, nothing is tracked. The default is None.
+    batch_size : int, optional
+        If larger than 1, the spectra are used `batch_size` at a time
+        by `sweep_robust_pca_batch`, which always updates using
+        `core.iterate_PCA_batch` so `pca_function` is not used.
+        The default is 1.
+
+    Returns
+    -------
+    eigen_system : EigenSystem
+        Container holding the updated eigen system.
+    counter : int
+        Next count of the increment.
+
+    """
+    if batch_size > 1:
+        return sweep_robust_pca_batch(eigen_system=eigen_system,
+                                      data=data,
+                                      errors=errors,
+                                      forget_param=forget_param,
+                                      spectra_order=spectra_order,
+                                      breakdown_point=breakdown_point,
+                                      c_sq=c_sq,
+                                      counter=counter,
+                                      tracked_eigen_system_dict=tracked_eigen_system_dict,
+                                      batch_size=batch_size)
+
+    if tracked_eigen_system_dict is None:
+        for sp in spectra_order:
+            error_array = None if errors is None else errors[sp]
+            eigen_system = pca_function(eigen_system, data[sp], forget_param,
+                                        error_array=error_array, delta=breakdown_point, c_sq=c_sq)
+
+        return eigen_system, counter + len(spectra_order)
+
+    eigenvalues_tracked = tracked_eigen_system_dict['W']
+    vk_tracked = tracked_eigen_system_dict['vqu']
+    scalesq_tracked = tracked_eigen_system_dict['sig2']
+    for sp in spectra_order:
+        eigenvalues_tracked[counter] = eigen_system.W
+        vk_tracked[counter] = eigen_system.vqu[0]
+        scalesq_tracked[counter] = eigen_system.sig2
+        counter += 1
+
+        error_array = None if errors is None else errors[sp]
+        eigen_system = pca_function(eigen_system, data[sp], forget_param,
+                                    error_array=error_array, delta=breakdown_point, c_sq=c_sq)
+
+    return eigen_system, counter
+
+def sweep_robust_pca_batch(eigen_system, data, errors, forget_param, spectra_order,
+                           breakdown_point=0.5, c_sq=0.787**2, counter=0,
+                           tracked_eigen_system_dict=None, batch_size=1):
+    """
+    Performs one pass of the robust PCA over the data, updating the eigen
+    system with `batch_size` spectra at a time using
+    `core.iterate_PCA_batch`.
+
+    Parameters
+    ----------
+    eigen_system : EigenSystem
+        Container holding the current eigenbasis, location (i.e., mean),
+        scale squared (sigma squared) and robust weights (vqu).
+    data : array_like
+        Data matrix
+        Dimensions:  [Number of spectra, length of spectra]
+    errors : None type or array_like
+        Array containing the data errors, where zero indicates bad data.
+        If None, assumes all the data is valid.
+    forget_param : float
+        Parameter which set when previous solutions are down-weighted.
+    spectra_order : array_like
+        Indices of the spectra in `data`, in the order they are to be used
+        to update the eigen system.
+    breakdown point : Float, optional
+        Between 0 to 0.5. Sets the robustness of the statistics.
+        The default is 0.5.
+    c_sq : float, optional
+        Parameter for setting when the robust function down-weights
+        outliers. The default is 0.787**2.
+    counter : int, optional
+        Current count of the increment (batch). The default is 0.
+    tracked_eigen_system_dict : None type or dict, optional
+        Preallocated dictionary (see `initialise_tracked_eigen_updates`)
+        tracking how the robust PCA changes for each batch. Updated in
+        place. If None, nothing is tracked. The default is None.
+    batch_size : int, optional
+        Number of spectra used in each update. The default is 1.
+
+    Returns
+    -------
+    eigen_system : EigenSystem
+        Container holding the updated eigen system.
+    counter : int
+        Next count of the increment.
+
+    """
+    for start in range(0, len(spectra_order), batch_size):
+        batch = spectra_order[start:start + batch_size]
+
+        if tracked_eigen_system_dict is not None:
+            tracked_eigen_system_dict['W'][counter] = eigen_system.W
+            tracked_eigen_system_dict['vqu'][counter] = eigen_system.vqu[0]
+            tracked_eigen_system_dict['sig2'][counter] = eigen_system.sig2
+        counter += 1
+
+        error_array = None if errors is None else errors[batch]
+        eigen_system = core.iterate_PCA_batch(eigen_system, data[batch], forget_param,
+                                              error_array=error_array, delta=breakdown_point, c_sq=c_sq)
+
+    return eigen_system, counter
+
+def randomise_data_order(data, errors=None, rng=None):
     """Method randomises the order of a the given data (and its corresponding
     errors if present)
 
@@ -576,6 +948,9 @@ def randomise_data_order(data, errors=None):
         Array to be randomised along the zeroth axis.
     errors : numpy.ndarray, optional
         Array to be randomised along the zeroth axis. The default is None.
+    rng : numpy.random.Generator, optional
+        Random number generator used to shuffle the data. If None, a new
+        unseeded generator is used. The default is None.
 
     Returns
     -------
@@ -586,59 +961,21 @@ def randomise_data_order(data, errors=None):
         same way as the data. If no errors are given, None is returned
 
     """
+    if rng is None:
+        rng = np.random.default_rng()
+
     amount_of_spectra = np.shape(data)[0]
-    random_indicies = np.arange(amount_of_spectra, dtype=int)
-    np.random.shuffle(random_indicies)
+    random_indicies = rng.permutation(amount_of_spectra)
     data_random = data[random_indicies]
 
     if errors is None:
         errors_random = errors
 
-    elif errors[0] is None:
-        errors_random = errors
-
     else:
         errors_random = errors[random_indicies]
 
     return data_random, errors_random
 
-def track_eigensystem_updates(counter, eigen_system_dict, tracked_eigen_system_dict, save_amount):
-    """
-    Updates the extra variables used to track the evolution of the eigen
-    system as the PCA increments.
-
-    Parameters
-    ----------
-    counter : int
-        Current count of the increment
-    eigen_system_dict : Dictionary containing the initial eigenbasis,
-    location (i.e., mean), scale squared (sigma squared) and robust
-    weights (vqu) for the robust PCA
-    tracked_eigen_system_dict : dict
-        Contains extra parameters tracking how the robust PCA changes for each
-        increment. Tracks the eigen values, the `v` weights and scale squared
-    save_amount : int
-        Total number of increments.
-
-    Returns
-    -------
-    tracked_eigen_system_dict : dict
-        Contains extra parameters tracking how the robust PCA changes for each
-        increment. Tracks the eigen values, the `v` weights and scale squared
-    counter + 1 : int
-        Next count of the increment.
-
-    """
-    if counter == 0:
-        amount_of_eigen = len(eigen_system_dict['W'])
-        tracked_eigen_system_dict = initialise_tracked_eigen_updates(save_amount, amount_of_eigen)
-
-    tracked_eigen_system_dict['W'][counter] = eigen_system_dict['W']
-    tracked_eigen_system_dict['vqu'][counter] = eigen_system_dict['vqu'][0]
-    tracked_eigen_system_dict['sig2'][counter] = eigen_system_dict['sig2']
-
-    return tracked_eigen_system_dict, counter + 1
-
 def initialise_tracked_eigen_updates(save_amount, amount_of_eigen):
     """
     Initialises the dictionary to track the evolution of the eigen
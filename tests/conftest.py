@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# The modules import each other by name, so the repository needs to be on
+# the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the robust PCA initialisation and precision using fake spectra
+made of a few components plus noise.
+"""
+
+import numpy as np
+import pytest
+
+import robustpca
+
+AMOUNT_OF_EIGEN = 100
+AMOUNT_TO_INITALISE = 200
+
+
+def make_fake_spectra(noise=1, num_spec=2000, num_pixels=300, num_components=10, seed=1):
+    rng = np.random.default_rng(seed)
+    components = rng.normal(size=[num_components, num_pixels])
+    data = rng.normal(size=[num_spec, num_components]) @ components \
+           + noise * rng.normal(size=[num_spec, num_pixels])
+    errors = np.ones_like(data)
+    errors[rng.random(data.shape) < 0.05] = 0
+
+    return data, errors
+
+
+@pytest.mark.parametrize('use_errors', [False, True])
+def test_initial_scale_matches_all_data(use_errors):
+    # The initial scale should be close to the scale found when the eigen
+    # vectors are made from all the other spectra
+    data, errors = make_fake_spectra()
+    errors = errors if use_errors else None
+
+    eigen_system = robustpca.initalise_robust_pca_param(data=data, errors=errors,
+                                                        amount_of_eigen=AMOUNT_OF_EIGEN,
+                                                        amount_to_initalise=AMOUNT_TO_INITALISE)
+
+    scale_spectra = slice(AMOUNT_TO_INITALISE, 2*AMOUNT_TO_INITALISE)
+    data_centred = robustpca.mean_subtracted_data(data=data, errors=errors)[0]
+    eigen_vectors = robustpca.initalise_eigensystem(data_centred=np.delete(data_centred, scale_spectra, axis=0),
+                                                    amount_of_eigen=AMOUNT_OF_EIGEN)[0]
+    residuals_sq = robustpca.get_mag_residuals_sq(data=data_centred[scale_spectra], eigen_vectors=eigen_vectors,
+                                                  error_map=None if errors is None else errors[scale_spectra])
+    scale_sq_all = robustpca.initalise_scale_using_residuals_sq(residuals_sq=residuals_sq,
+                                                                amount_of_eigen=AMOUNT_OF_EIGEN)
+
+    assert np.isclose(eigen_system.sig2, scale_sq_all, rtol=0.2)
+
+
+def test_initialise_needs_more_spectra_than_eigen_vectors():
+    data, _ = make_fake_spectra()
+    with pytest.raises(ValueError):
+        robustpca.initalise_robust_pca_param(data=data, amount_of_eigen=AMOUNT_TO_INITALISE,
+                                             amount_to_initalise=AMOUNT_TO_INITALISE)
+
+
+def test_single_precision_matches_double():
+    # Spectra with little noise, where the residuals are a tiny fraction
+    # of the spectra
+    data, _ = make_fake_spectra(noise=0.01, seed=2)
+
+    scale_sq_initial = {}
+    eigen_system_dict = {}
+    for dtype in [np.float32, np.float64]:
+        scale_sq_initial[dtype] = robustpca.initalise_robust_pca_param(data=data.astype(dtype),
+                                                                       amount_of_eigen=AMOUNT_OF_EIGEN,
+                                                                       amount_to_initalise=AMOUNT_TO_INITALISE).sig2
+        eigen_system_dict[dtype] = robustpca.run_robust_pca(data, amount_of_eigen=20,
+                                                            number_of_iterations=2, dtype=dtype)
+
+    assert np.isclose(scale_sq_initial[np.float32], scale_sq_initial[np.float64], rtol=1e-4)
+    single, double = eigen_system_dict[np.float32], eigen_system_dict[np.float64]
+    assert np.allclose(single['W'][:10], double['W'][:10], rtol=1e-3)
+    assert np.isclose(single['sig2'], double['sig2'], rtol=1e-3)
+
+
+def test_single_precision_eigen_vectors_stay_orthonormal():
+    # Many eigen vectors whose eigen values span 8 orders of magnitude
+    rng = np.random.default_rng(3)
+    num_pixels = 300
+    components = np.linalg.qr(rng.normal(size=[num_pixels, AMOUNT_OF_EIGEN]))[0]
+    amplitudes = rng.normal(size=[1000, AMOUNT_OF_EIGEN]) * np.logspace(0, -4, AMOUNT_OF_EIGEN)
+    data = amplitudes @ components.T + 1e-5 * rng.normal(size=[1000, num_pixels])
+
+    single = robustpca.run_robust_pca(data, amount_of_eigen=AMOUNT_OF_EIGEN, number_of_iterations=1)
+    double = robustpca.run_robust_pca(data, amount_of_eigen=AMOUNT_OF_EIGEN, number_of_iterations=1,
+                                      dtype=np.float64)
+
+    eigen_vectors = single['U'].astype(np.float64)
+    assert np.allclose(eigen_vectors.T @ eigen_vectors, np.eye(AMOUNT_OF_EIGEN), atol=1e-4)
+    assert np.allclose(single['W'][:10], double['W'][:10], rtol=0.05)